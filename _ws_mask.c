@@ -0,0 +1,169 @@
+/*
+ * SIMD WebSocket payload masking (RFC 6455 section 5.3)
+ *
+ * mask(buf, key) -> bytes
+ *   XORs buf with the repeating 4-byte key. Masking and unmasking are the
+ *   same operation. Uses AVX2 (32 bytes/iter), SSE2 (16 bytes/iter) or
+ *   NEON (16 bytes/iter) depending on what the compiler targets, then a
+ *   scalar tail.
+ *
+ * mask_into(out, offset, buf, key) -> None
+ *   Same XOR, written straight into a preallocated frame (e.g. the
+ *   bytearray built by create_frame) instead of a new bytes object.
+ *
+ * build:
+ *   cc -O3 -march=native -shared -fPIC $(python3-config --includes) \
+ *      _ws_mask.c -o _ws_mask$(python3-config --extension-suffix)
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+
+#if defined(__AVX2__) || defined(__SSE2__)
+#include <immintrin.h>
+#endif
+#if defined(__ARM_NEON)
+#include <arm_neon.h>
+#endif
+
+static void
+mask_into(unsigned char *out, const unsigned char *in, Py_ssize_t n,
+          const unsigned char *key)
+{
+    Py_ssize_t i = 0;
+    uint32_t k;
+
+    /* key in memory order, so lane bytes line up with key[i % 4] */
+    memcpy(&k, key, 4);
+
+#if defined(__AVX2__)
+    __m256i k256 = _mm256_set1_epi32((int)k);
+    for (; i + 32 <= n; i += 32) {
+        __m256i v = _mm256_loadu_si256((const __m256i *)(in + i));
+        _mm256_storeu_si256((__m256i *)(out + i), _mm256_xor_si256(v, k256));
+    }
+#endif
+#if defined(__SSE2__)
+    __m128i k128 = _mm_set1_epi32((int)k);
+    for (; i + 16 <= n; i += 16) {
+        __m128i v = _mm_loadu_si128((const __m128i *)(in + i));
+        _mm_storeu_si128((__m128i *)(out + i), _mm_xor_si128(v, k128));
+    }
+#elif defined(__ARM_NEON)
+    uint8x16_t k128 = vreinterpretq_u8_u32(vdupq_n_u32(k));
+    for (; i + 16 <= n; i += 16) {
+        vst1q_u8(out + i, veorq_u8(vld1q_u8(in + i), k128));
+    }
+#endif
+    /* i stays a multiple of 4, so every word starts at key[0] */
+    for (; i + 4 <= n; i += 4) {
+        uint32_t w;
+        memcpy(&w, in + i, 4);
+        w ^= k;
+        memcpy(out + i, &w, 4);
+    }
+    /* 0-3 byte tail, unrolled: no loop, no modulo */
+    switch (n - i) {
+    case 3:
+        out[i + 2] = in[i + 2] ^ key[2];
+        /* fall through */
+    case 2:
+        out[i + 1] = in[i + 1] ^ key[1];
+        /* fall through */
+    case 1:
+        out[i] = in[i] ^ key[0];
+    }
+}
+
+static PyObject *
+ws_mask(PyObject *self, PyObject *args)
+{
+    Py_buffer buf, key;
+    PyObject *result;
+
+    if (!PyArg_ParseTuple(args, "y*y*:mask", &buf, &key)) {
+        return NULL;
+    }
+    if (key.len != 4) {
+        PyErr_SetString(PyExc_ValueError, "masking key must be 4 bytes");
+        PyBuffer_Release(&buf);
+        PyBuffer_Release(&key);
+        return NULL;
+    }
+
+    result = PyBytes_FromStringAndSize(NULL, buf.len);
+    if (result != NULL) {
+        /* only worth dropping the GIL for large frames */
+        PyThreadState *ts = buf.len >= 65536 ? PyEval_SaveThread() : NULL;
+        mask_into((unsigned char *)PyBytes_AS_STRING(result),
+                  (const unsigned char *)buf.buf, buf.len,
+                  (const unsigned char *)key.buf);
+        if (ts != NULL) {
+            PyEval_RestoreThread(ts);
+        }
+    }
+    PyBuffer_Release(&buf);
+    PyBuffer_Release(&key);
+    return result;
+}
+
+static PyObject *
+ws_mask_into(PyObject *self, PyObject *args)
+{
+    Py_buffer out, buf, key;
+    Py_ssize_t offset;
+
+    if (!PyArg_ParseTuple(args, "w*ny*y*:mask_into", &out, &offset, &buf, &key)) {
+        return NULL;
+    }
+    if (key.len != 4) {
+        PyErr_SetString(PyExc_ValueError, "masking key must be 4 bytes");
+        goto error;
+    }
+    if (offset < 0 || offset > out.len || buf.len > out.len - offset) {
+        PyErr_SetString(PyExc_ValueError, "payload does not fit in output buffer");
+        goto error;
+    }
+
+    PyThreadState *ts = buf.len >= 65536 ? PyEval_SaveThread() : NULL;
+    mask_into((unsigned char *)out.buf + offset,
+              (const unsigned char *)buf.buf, buf.len,
+              (const unsigned char *)key.buf);
+    if (ts != NULL) {
+        PyEval_RestoreThread(ts);
+    }
+    PyBuffer_Release(&out);
+    PyBuffer_Release(&buf);
+    PyBuffer_Release(&key);
+    Py_RETURN_NONE;
+
+error:
+    PyBuffer_Release(&out);
+    PyBuffer_Release(&buf);
+    PyBuffer_Release(&key);
+    return NULL;
+}
+
+static PyMethodDef ws_mask_methods[] = {
+    {"mask", ws_mask, METH_VARARGS,
+     "mask(buf, key) -> bytes\n\nXOR buf with the repeating 4-byte key."},
+    {"mask_into", ws_mask_into, METH_VARARGS,
+     "mask_into(out, offset, buf, key)\n\n"
+     "Write buf XOR key into the writable buffer out, starting at offset."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef ws_mask_module = {
+    PyModuleDef_HEAD_INIT,
+    "_ws_mask",
+    "SIMD WebSocket payload masking",
+    -1,
+    ws_mask_methods
+};
+
+PyMODINIT_FUNC
+PyInit__ws_mask(void)
+{
+    return PyModule_Create(&ws_mask_module);
+}
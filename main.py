@@ -4,219 +4,539 @@ import hashlib
 import base64
 import struct
 import select
+import selectors
 import json
+import os
+import random
 import time
 import sys
 
+try:
+    import numpy as np
+except ImportError:  # optional, only used for larger payloads
+    np = None
+
 # ======================
 # webSocket Protocol Implementation
 # ======================
 
+# opcodes as module globals, hot paths skip the WebSocketFrame attribute lookup
+OPCODE_CONT = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# close status codes (RFC 6455 section 7.4.1)
+CLOSE_INVALID_DATA = 1007
+CLOSE_MESSAGE_TOO_BIG = 1009
+
+# Masking keys only have to be unpredictable to intermediaries (RFC 6455
+# section 10.3); a PRNG seeded from the OS avoids a clock read per frame
+_mask_rng = random.Random(os.urandom(16))
+
+# precompiled extended payload length readers
+_unpack_h = struct.Struct(">H").unpack_from
+_unpack_q = struct.Struct(">Q").unpack_from
+# frame headers: FIN/opcode, MASK/length byte, [extended length], [masking key]
+_pack_small_header = struct.Struct(">BB4s").pack
+_pack_small_header_unmasked = struct.Struct(">BB").pack
+_header16 = struct.Struct(">BBH")
+_header16_masked = struct.Struct(">BBH4s")
+_header64 = struct.Struct(">BBQ")
+_header64_masked = struct.Struct(">BBQ4s")
+
+def _mask(payload, masking_key):
+    """XOR payload with the 4-byte masking key (same op masks and unmasks)"""
+    payload_len = len(payload)
+    if np is None or payload_len < 512:
+        # one bignum XOR, done in C over machine words; beats numpy's
+        # call overhead on short chat-sized payloads
+        key_int = int.from_bytes(masking_key * ((payload_len + 3) // 4), 'big')
+        key_int >>= 8 * (-payload_len & 3)
+        return (int.from_bytes(payload, 'big') ^ key_int).to_bytes(payload_len, 'big')
+    # XOR the 4-byte aligned head as uint32 words in one vectorized op
+    n4 = payload_len & ~3
+    key_u32 = np.uint32(int.from_bytes(masking_key, 'little'))
+    head = np.frombuffer(payload, dtype='<u4', count=n4 >> 2)
+    out = bytearray((head ^ key_u32).tobytes())
+    # 0-3 byte tail, unrolled since it always starts at masking_key[0]
+    tail = payload_len - n4
+    if tail:
+        out.append(payload[n4] ^ masking_key[0])
+        if tail > 1:
+            out.append(payload[n4 + 1] ^ masking_key[1])
+            if tail > 2:
+                out.append(payload[n4 + 2] ^ masking_key[2])
+    return out
+
+def _mask_into(out, offset, payload, masking_key):
+    """Write payload XORed with the masking key into out at offset"""
+    out[offset:offset + len(payload)] = _mask(payload, masking_key)
+
+try:
+    # SIMD C extension, see _ws_mask.c for build instructions
+    from _ws_mask import mask as _mask, mask_into as _mask_into
+except ImportError:
+    pass
+
+def _create_frame_small(payload, opcode, masking_key):
+    """Masked frame for payloads of at most 125 bytes, the usual chat case
+
+    No length-class branches: header and key are one precompiled pack,
+    followed by the masked payload.
+    """
+    header = _pack_small_header(0x80 | opcode, 0x80 | len(payload), masking_key)
+    return header + _mask(payload, masking_key)
+
+class FrameTooLargeError(ValueError):
+    """Frame header declares a payload over the receiver's limit"""
+
 class WebSocketFrame:
     """will be handling RFC 6544
     v.0.1 - text, binary, close, ping
     """
-    OPCODE_CONT = 0x0
-    OPCODE_TEXT = 0x1
-    OPCODE_BINARY = 0x2
-    OPCODE_CLOSE = 0x8
-    OPCODE_PING = 0x9
-    OPCODE_PONG = 0xA
+    OPCODE_CONT = OPCODE_CONT
+    OPCODE_TEXT = OPCODE_TEXT
+    OPCODE_BINARY = OPCODE_BINARY
+    OPCODE_CLOSE = OPCODE_CLOSE
+    OPCODE_PING = OPCODE_PING
+    OPCODE_PONG = OPCODE_PONG
 
     @staticmethod
-    def create_frame(payload, opcode=OPCODE_TEXT, mask=True):
+    def create_frame(payload, opcode=OPCODE_TEXT, mask=True, rng=_mask_rng):
         """
         creating a WebSocket frame
         - FIN bit set (1)
         - RSV bits cleared (0)
-        - Payload masked for client-to-server
+        - Payload masked for client-to-server, left as-is when mask=False
+          (server-to-client frames must not be masked)
+        - Masking key drawn from rng, any object with getrandbits()
+
+        Masked payloads of up to 125 bytes go through _create_frame_small.
+        Larger ones get their whole header, masking key included, from a
+        single precompiled struct pack_into into one preallocated bytearray.
         """
-        frame = bytearray()
-        # FIN (1), RSV1-3 (0), opcode (4 bits)
-        frame.append(0x80 | opcode)
         payload_len = len(payload)
+        # FIN (1), RSV1-3 (0), opcode (4 bits)
+        byte1 = 0x80 | opcode
         if payload_len <= 125:
-            frame.append(0x80 | payload_len)  
-        elif payload_len <= 65535:
-            frame.append(0x80 | 126)
-            frame.extend(struct.pack(">H", payload_len))
-        else:
-            frame.append(0x80 | 127)
-            frame.extend(struct.pack(">Q", payload_len))
+            if mask:
+                return _create_frame_small(payload, opcode, rng.getrandbits(32).to_bytes(4, 'big'))
+            return _pack_small_header_unmasked(byte1, payload_len) + payload
         
-        masking_key = struct.pack(">I", int(time.time() * 1000) % 0xFFFFFFFF)
-        frame.extend(masking_key)
-        masked_payload = bytearray()
-        for i, byte in enumerate(payload):
-            masked_payload.append(byte ^ masking_key[i % 4])
-        frame.extend(masked_payload)
+        if payload_len <= 65535:
+            header, len_byte = (_header16_masked if mask else _header16), 126
+        else:
+            header, len_byte = (_header64_masked if mask else _header64), 127
+        header_size = header.size
+        frame = bytearray(header_size + payload_len)
+        if mask:
+            masking_key = rng.getrandbits(32).to_bytes(4, 'big')
+            header.pack_into(frame, 0, byte1, 0x80 | len_byte, payload_len, masking_key)
+            _mask_into(frame, header_size, payload, masking_key)
+        else:
+            header.pack_into(frame, 0, byte1, len_byte, payload_len)
+            frame[header_size:] = payload
         
-        return bytes(frame)
+        return frame
 
     @staticmethod
-    def parse_frame(data):
-        """Parse WebSocket frame and return (opcode, payload, payload_length, fin)"""
-        if len(data) < 2:
+    def parse_frame(data, offset=0, max_payload=None, zero_copy=False):
+        """Parse WebSocket frame and return (opcode, payload, payload_length, fin, frame_length)
+
+        Parsing starts at data[offset], so callers can walk a buffer holding
+        several frames without slicing it. payload is bytes, unless
+        zero_copy=True: then an unmasked payload is a memoryview into data,
+        only valid until data is next written to (e.g. the next RecvBuffer
+        read), and a masked one may be a bytearray. Raises
+        FrameTooLargeError as soon as the header declares more than
+        max_payload bytes.
+        """
+        avail = len(data) - offset
+        if avail < 2:
             return None, None, 0, False, 0
         
-        byte1 = data[0]
+        byte1 = data[offset]
         fin = (byte1 & 0x80) != 0
         opcode = byte1 & 0x0F
-        byte2 = data[1]
+        byte2 = data[offset + 1]
         mask = (byte2 & 0x80) != 0
         payload_len = byte2 & 0x7F
         header_size = 2
         if payload_len == 126:
-            if len(data) < 4:
+            if avail < 4:
                 return None, None, 0, False, 0
-            payload_len = struct.unpack(">H", data[2:4])[0]
+            payload_len = _unpack_h(data, offset + 2)[0]
             header_size += 2
         elif payload_len == 127:
-            if len(data) < 10:
+            if avail < 10:
                 return None, None, 0, False, 0
-            payload_len = struct.unpack(">Q", data[2:10])[0]
+            payload_len = _unpack_q(data, offset + 2)[0]
             header_size += 8
+        if max_payload is not None and payload_len > max_payload:
+            raise FrameTooLargeError(f"frame payload of {payload_len} bytes exceeds {max_payload}")
         if mask:
             header_size += 4
-            masking_key = data[header_size-4:header_size]
-        if len(data) < header_size + payload_len:
+            masking_key = bytes(data[offset + header_size - 4:offset + header_size])
+        if avail < header_size + payload_len:
             return None, None, 0, False, 0
-        payload = data[header_size:header_size+payload_len]
+        start = offset + header_size
+        payload = memoryview(data)[start:start + payload_len]
         if mask:
-            payload = bytearray(payload)
-            for i in range(payload_len):
-                payload[i] ^= masking_key[i % 4]
+            payload = _mask(payload, masking_key)
+        if not zero_copy and type(payload) is not bytes:
+            payload = bytes(payload)
         
-        return opcode, bytes(payload), payload_len, fin, header_size + payload_len
+        return opcode, payload, payload_len, fin, header_size + payload_len
+
+# empty server-to-client control frames never change, build them once
+_PONG_FRAME_UNMASKED = bytes([0x80 | OPCODE_PONG, 0x00])
+_CLOSE_FRAME_UNMASKED = bytes([0x80 | OPCODE_CLOSE, 0x00])
+
+class RecvBuffer:
+    """Reusable receive buffer: filled by recv_into, consumed by offset
+
+    Bytes in buf[read_off:write_off] are received but not yet parsed. Both
+    offsets go back to 0 once everything is consumed, so steady-state
+    traffic reuses the same memory without allocating per recv.
+    """
+    
+    def __init__(self, size=65536):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.read_off = 0
+        self.write_off = 0
+    
+    def recv_from(self, sock):
+        """recv_into the free tail of the buffer, return the byte count"""
+        if self.write_off == len(self.buf):
+            self._make_room()
+        n = sock.recv_into(self.view[self.write_off:])
+        self.write_off += n
+        return n
+    
+    def data(self):
+        """View of everything received so far, parse from read_off"""
+        return self.view[:self.write_off]
+    
+    def consume(self, offset):
+        """Mark bytes before offset as parsed"""
+        if offset == self.write_off:
+            self.read_off = self.write_off = 0
+        else:
+            self.read_off = offset
+    
+    def _make_room(self):
+        pending = self.write_off - self.read_off
+        if self.read_off:
+            # move the partial frame to the front
+            self.buf[:pending] = self.buf[self.read_off:self.write_off]
+        else:
+            # a single frame larger than the buffer; callers cap frame size
+            # through parse_frame's max_payload, which bounds this growth
+            buf = bytearray(len(self.buf) * 2)
+            buf[:pending] = self.buf
+            self.buf = buf
+            self.view = memoryview(buf)
+        self.read_off = 0
+        self.write_off = pending
+
+def _tune_socket(sock, bufsize=262144):
+    """Low-latency options for a connected chat socket"""
+    # small frames must not wait on Nagle's algorithm
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # room for broadcast bursts without blocking the event loop
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, bufsize)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufsize)
+    if hasattr(socket, 'TCP_QUICKACK'):  # Linux only
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
 
 # ======================
 # WebSocket Server
 # ======================
 
 class WebSocketServer:
-    """WebSocket server implementing RFC 6455 handshake and frame handling"""
+    """WebSocket server implementing RFC 6455 handshake and frame handling
+
+    All client sockets are served by one selector loop (epoll/kqueue)
+    running in start(), no thread per client. Pass selector to swap in
+    another selectors.BaseSelector implementation.
+    """
     GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+    GUID_BYTES = GUID.encode()
+    # queued output per client before it is dropped as a stalled reader
+    MAX_PENDING_OUTPUT = 1 << 20
+    # largest frame payload accepted from a client, bounds its RecvBuffer
+    MAX_PAYLOAD_SIZE = 1 << 20
     
-    def __init__(self, host='127.0.0.1', port=8000):
+    def __init__(self, host='127.0.0.1', port=8000, selector=None):
         self.host = host
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.clients = {}
+        self.sel = selector if selector is not None else selectors.DefaultSelector()
+        # lets stop() wake the selector from another thread
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        # joined clients as parallel lists, broadcast walks client_socks
+        # directly; sock_to_idx gives O(1) swap-with-last removal
+        self.client_socks = []
+        self.client_usernames = []
+        self.sock_to_idx = {}
         self.running = False
     
-    def _handshake(self, client_sock):
-        data = client_sock.recv(4096).decode('utf-8')
-        if not data.startswith('GET'):
+    @staticmethod
+    def _header(request, lowered, needle):
+        """Return the value of the header matched by needle (b'\\r\\nname:') or None"""
+        start = lowered.find(needle)
+        if start == -1:
+            return None
+        start += len(needle)
+        end = lowered.find(b'\r\n', start)
+        return request[start:end].strip()
+    
+    def _handshake(self, client_sock, request):
+        """Answer the HTTP upgrade request, parsed straight from the raw bytes"""
+        if not request.startswith(b'GET'):
             return False
         
-        headers = {}
-        for line in data.split('\r\n')[1:]:
-            if ': ' in line:
-                key, val = line.split(': ', 1)
-                headers[key.lower()] = val
-        
-        if ('upgrade' not in headers or 'websocket' not in headers['upgrade'].lower() or
-            'connection' not in headers or 'upgrade' not in headers['connection'].lower() or
-            'sec-websocket-key' not in headers):
+        # header names are case-insensitive, values are sliced from request
+        lowered = request.lower()
+        upgrade = self._header(lowered, lowered, b'\r\nupgrade:')
+        connection = self._header(lowered, lowered, b'\r\nconnection:')
+        key = self._header(request, lowered, b'\r\nsec-websocket-key:')
+        if (upgrade is None or b'websocket' not in upgrade or
+            connection is None or b'upgrade' not in connection or
+            not key):
             return False
         
-        key = headers['sec-websocket-key'] + self.GUID
-        accept_key = base64.b64encode(hashlib.sha1(key.encode()).digest()).decode()
+        accept_key = base64.b64encode(hashlib.sha1(key + self.GUID_BYTES).digest())
         
         response = (
-            "HTTP/1.1 101 Switching Protocols\r\n"
-            "Upgrade: websocket\r\n"
-            "Connection: Upgrade\r\n"
-            f"Sec-WebSocket-Accept: {accept_key}\r\n\r\n"
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept_key + b"\r\n\r\n"
         )
-        client_sock.send(response.encode())
+        self._send(client_sock, response)
         return True
     
-    def _handle_client(self, client_sock, addr):
-        """Handle client connection after handshake"""
+    def _accept(self):
+        """Accept a pending connection and register it with the selector"""
         try:
-            while self.running:
-                ready = select.select([client_sock], [], [], 1)
-                if not ready[0]:
-                    continue
-                
-                data = client_sock.recv(4096)
-                if not data:
-                    break
-                
-                buffer = data
-                while buffer:
-                    opcode, payload, plen, fin, frame_len = WebSocketFrame.parse_frame(buffer)
-                    if opcode is None:  # Incomplete frame
-                        break
-                    
-                    if opcode == WebSocketFrame.OPCODE_TEXT:
-                        message = payload.decode('utf-8')
-                        self.broadcast(message, client_sock)
-                    elif opcode == WebSocketFrame.OPCODE_CLOSE:
-                        self.close_client(client_sock)
-                        return
-                    elif opcode == WebSocketFrame.OPCODE_PING:
-                        pong_frame = WebSocketFrame.create_frame(b'', opcode=WebSocketFrame.OPCODE_PONG)
-                        client_sock.send(pong_frame)
-                    
-                    buffer = buffer[frame_len:]
-        except (ConnectionResetError, OSError):
-            pass
-        finally:
+            client_sock, addr = self.sock.accept()
+        except BlockingIOError:
+            return
+        client_sock.setblocking(False)
+        _tune_socket(client_sock)
+        state = {'rbuf': RecvBuffer(), 'upgraded': False, 'username': None, 'outbuf': bytearray(),
+                 'closed': False}
+        self.sel.register(client_sock, selectors.EVENT_READ, state)
+    
+    def _handle_client(self, client_sock, state):
+        """Read from a ready client and process every complete frame"""
+        rbuf = state['rbuf']
+        if not rbuf.recv_from(client_sock):
             self.close_client(client_sock)
+            return
+        
+        # frames are walked by offset through the receive buffer, nothing
+        # is sliced or copied per frame
+        offset = rbuf.read_off
+        if not state['upgraded']:
+            end = rbuf.buf.find(b'\r\n\r\n', offset, rbuf.write_off)
+            if end == -1:
+                if rbuf.write_off > 4096:  # oversized handshake
+                    self.close_client(client_sock)
+                return
+            if not self._handshake(client_sock, rbuf.buf[offset:end + 4]):
+                self.close_client(client_sock)
+                return
+            state['upgraded'] = True
+            offset = end + 4
+        
+        # hoist attribute lookups out of the per-frame loop
+        parse = WebSocketFrame.parse_frame
+        max_payload = self.MAX_PAYLOAD_SIZE
+        broadcast = self.broadcast
+        OP_TEXT = OPCODE_TEXT
+        OP_CLOSE = OPCODE_CLOSE
+        OP_PING = OPCODE_PING
+        buffer = rbuf.data()
+        buffer_len = rbuf.write_off
+        while offset < buffer_len:
+            # payloads are decoded or copied before the next read, so the
+            # zero-copy view into the receive buffer is safe here
+            opcode, payload, plen, fin, frame_len = parse(buffer, offset, max_payload, True)
+            if opcode is None:  # Incomplete frame
+                break
+            
+            offset += frame_len
+            if state['username'] is None:
+                # Get username from first message
+                if opcode != OP_TEXT:
+                    self.close_client(client_sock)
+                    return
+                username = str(payload, 'utf-8')
+                state['username'] = username
+                self._add_client(client_sock, username)
+                broadcast(f"{username} joined the chat")
+            elif opcode == OP_TEXT:
+                message = str(payload, 'utf-8')
+                broadcast(message, client_sock)
+            elif opcode == OP_CLOSE:
+                self.close_client(client_sock)
+                return
+            elif opcode == OP_PING:
+                # a pong echoes the ping's application data
+                if plen:
+                    self._send(client_sock, WebSocketFrame.create_frame(payload, opcode=OPCODE_PONG, mask=False))
+                else:
+                    self._send(client_sock, _PONG_FRAME_UNMASKED)
+            if state['closed']:
+                # a nested broadcast dropped this client, stop parsing its frames
+                return
+        rbuf.consume(offset)
+    
+    def _send(self, client_sock, data):
+        """Write data now if nothing is queued, buffer the rest for EVENT_WRITE
+
+        Raises ConnectionError once a client that stopped reading would
+        push its queue past MAX_PENDING_OUTPUT.
+        """
+        key = self.sel.get_key(client_sock)
+        outbuf = key.data['outbuf']
+        if outbuf and len(outbuf) + len(data) > self.MAX_PENDING_OUTPUT:
+            raise ConnectionError("client is not reading, output queue full")
+        if not outbuf:
+            try:
+                sent = client_sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            if sent == len(data):
+                return
+            data = data[sent:]
+            if len(data) > self.MAX_PENDING_OUTPUT:
+                raise ConnectionError("client is not reading, output queue full")
+            self.sel.modify(client_sock, selectors.EVENT_READ | selectors.EVENT_WRITE, key.data)
+        outbuf += data
+    
+    def _flush(self, client_sock, state):
+        """Drain queued output once the socket is writable again"""
+        outbuf = state['outbuf']
+        sent = client_sock.send(outbuf)
+        del outbuf[:sent]
+        if not outbuf:
+            self.sel.modify(client_sock, selectors.EVENT_READ, state)
     
     def broadcast(self, message, sender_sock=None):
         """Send message to all connected clients"""
-        frame = WebSocketFrame.create_frame(message.encode('utf-8'))
-        for sock in list(self.clients.keys()):
-            if sock != sender_sock:
+        # server-to-client frames are sent unmasked (RFC 6455 section 5.1)
+        frame = WebSocketFrame.create_frame(message.encode('utf-8'), mask=False)
+        failed = []
+        for sock in self.client_socks:
+            if sock is not sender_sock:
                 try:
-                    sock.send(frame)
-                except (OSError, ConnectionResetError):
-                    self.close_client(sock)
+                    self._send(sock, frame)
+                except (OSError, KeyError, ValueError):
+                    failed.append(sock)
+        # close after the loop, close_client reorders client_socks
+        for sock in failed:
+            self.close_client(sock)
     
-    def close_client(self, client_sock):
-        """Close client connection gracefully"""
-        if client_sock in self.clients:
-            username = self.clients.pop(client_sock)
-            close_frame = WebSocketFrame.create_frame(b'', opcode=WebSocketFrame.OPCODE_CLOSE)
-            try:
-                client_sock.send(close_frame)
-                client_sock.close()
-            except OSError:
-                pass
+    def _add_client(self, client_sock, username):
+        """Register a client once it has sent its username"""
+        self.sock_to_idx[client_sock] = len(self.client_socks)
+        self.client_socks.append(client_sock)
+        self.client_usernames.append(username)
+    
+    def _remove_client(self, client_sock):
+        """Drop a joined client, return its username (None if not joined)"""
+        idx = self.sock_to_idx.pop(client_sock, None)
+        if idx is None:
+            return None
+        username = self.client_usernames[idx]
+        last_sock = self.client_socks.pop()
+        last_username = self.client_usernames.pop()
+        if idx < len(self.client_socks):
+            self.client_socks[idx] = last_sock
+            self.client_usernames[idx] = last_username
+            self.sock_to_idx[last_sock] = idx
+        return username
+    
+    def close_client(self, client_sock, code=None):
+        """Close client connection gracefully, with an optional close status code"""
+        username = self._remove_client(client_sock)
+        try:
+            key = self.sel.unregister(client_sock)
+        except (KeyError, ValueError):  # already closed
+            return
+        key.data['closed'] = True
+        try:
+            # with output still queued the close frame would land in the
+            # middle of a half-sent frame, so only send it on a clean stream
+            if key.data['upgraded'] and not key.data['outbuf']:
+                if code is None:
+                    client_sock.send(_CLOSE_FRAME_UNMASKED)
+                else:
+                    client_sock.send(WebSocketFrame.create_frame(
+                        code.to_bytes(2, 'big'), opcode=OPCODE_CLOSE, mask=False))
+        except OSError:
+            pass
+        client_sock.close()
+        if username is not None:
             self.broadcast(f"{username} has left the chat")
     
     def start(self):
-        """Start the WebSocket server"""
+        """Start the WebSocket server and run the event loop until stop()"""
         self.sock.bind((self.host, self.port))
         self.sock.listen(5)
+        self.sock.setblocking(False)
+        self.sel.register(self.sock, selectors.EVENT_READ)
+        self.sel.register(self._wakeup_r, selectors.EVENT_READ)
         self.running = True
         print(f"WebSocket server listening on {self.host}:{self.port}")
         
-        while self.running:
-            try:
-                client_sock, addr = self.sock.accept()
-                if self._handshake(client_sock):
-                    # Get username from first message
-                    data = client_sock.recv(4096)
-                    opcode, payload, _, _, _ = WebSocketFrame.parse_frame(data)
-                    if opcode == WebSocketFrame.OPCODE_TEXT:
-                        username = payload.decode('utf-8')
-                        self.clients[client_sock] = username
-                        self.broadcast(f"{username} joined the chat")
-                        threading.Thread(target=self._handle_client, args=(client_sock, addr), daemon=True).start()
-            except OSError:
-                break
+        try:
+            while self.running:
+                for key, events in self.sel.select():
+                    sock = key.fileobj
+                    if sock is self.sock:
+                        self._accept()
+                    elif sock is self._wakeup_r:
+                        sock.recv(64)
+                    else:
+                        try:
+                            if events & selectors.EVENT_WRITE:
+                                self._flush(sock, key.data)
+                            if events & selectors.EVENT_READ:
+                                self._handle_client(sock, key.data)
+                        except FrameTooLargeError:
+                            self.close_client(sock, CLOSE_MESSAGE_TOO_BIG)
+                        except UnicodeDecodeError:
+                            # text frames must be valid UTF-8, drop only this client
+                            self.close_client(sock, CLOSE_INVALID_DATA)
+                        except (ConnectionResetError, OSError, KeyError, ValueError):
+                            # KeyError/ValueError: selector lookup on a socket
+                            # that was closed earlier in this batch
+                            self.close_client(sock)
+        finally:
+            for key in list(self.sel.get_map().values()):
+                if key.data is not None:
+                    self.close_client(key.fileobj)
+            self.sel.close()
+            self.sock.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
     
     def stop(self):
-        """Stop the server gracefully"""
+        """Stop the server gracefully, start() closes all clients on exit"""
         self.running = False
-        for sock in list(self.clients.keys()):
-            self.close_client(sock)
-        self.sock.close()
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass
 
 # ======================
 # WebSocket Client
@@ -230,11 +550,14 @@ class WebSocketClient:
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.connected = False
+        self._mask_rng = random.Random(os.urandom(16))
+        self.rbuf = RecvBuffer()
     
     def connect(self, username):
         """Establish WebSocket connection with username"""
         try:
             self.sock.connect((self.host, self.port))
+            _tune_socket(self.sock)
             self._handshake()
             self.connected = True
             self.send(username)  # Send username as first message
@@ -263,33 +586,40 @@ class WebSocketClient:
     
     def send(self, message):
         """Send text message to server"""
-        frame = WebSocketFrame.create_frame(message.encode('utf-8'))
+        frame = WebSocketFrame.create_frame(message.encode('utf-8'), rng=self._mask_rng)
         self.sock.send(frame)
     
     def receive(self):
-        """Receive and decode messages from server"""
-        buffer = b''
+        """Receive and decode messages from server
+
+        Frames that arrive in the same recv stay in self.rbuf and are
+        returned by the following calls.
+        """
+        rbuf = self.rbuf
         while self.connected:
             try:
+                buffer = rbuf.data()
+                offset = rbuf.read_off
+                while offset < rbuf.write_off:
+                    opcode, payload, plen, fin, frame_len = WebSocketFrame.parse_frame(buffer, offset, zero_copy=True)
+                    if opcode is None:  # incomplete frame
+                        break
+                    
+                    offset += frame_len
+                    if opcode == OPCODE_TEXT:
+                        message = str(payload, 'utf-8')
+                        rbuf.consume(offset)
+                        return message
+                    elif opcode == OPCODE_CLOSE:
+                        self.close()
+                        return None
+                rbuf.consume(offset)
+                
                 ready = select.select([self.sock], [], [], 0.1)
                 if ready[0]:
-                    data = self.sock.recv(4096)
-                    if not data:
+                    if not rbuf.recv_from(self.sock):
                         self.close()
                         return None
-                    buffer += data
-                    
-                    while buffer:
-                        opcode, payload, plen, fin, frame_len = WebSocketFrame.parse_frame(buffer)
-                        if opcode is None:  # incomplete frame
-                            break
-                        
-                        buffer = buffer[frame_len:]
-                        if opcode == WebSocketFrame.OPCODE_TEXT:
-                            return payload.decode('utf-8')
-                        elif opcode == WebSocketFrame.OPCODE_CLOSE:
-                            self.close()
-                            return None
             except (ConnectionResetError, OSError):
                 self.close()
                 return None
@@ -299,7 +629,7 @@ class WebSocketClient:
         """Close connection gracefully"""
         if self.connected:
             try:
-                close_frame = WebSocketFrame.create_frame(b'', opcode=WebSocketFrame.OPCODE_CLOSE)
+                close_frame = WebSocketFrame.create_frame(b'', opcode=OPCODE_CLOSE, rng=self._mask_rng)
                 self.sock.send(close_frame)
             except OSError:
                 pass
@@ -318,10 +648,12 @@ def run_chat_server():
     server_thread.start()
     
     try:
-        while True:
-            time.sleep(1)
+        # blocks without periodic wakeups; Ctrl+C still interrupts it, and it
+        # returns on its own if the server thread dies (e.g. bind failure)
+        server_thread.join()
     except KeyboardInterrupt:
         server.stop()
+        server_thread.join()
         print("\nServer stopped")
 
 def run_chat_client(username):